@@ -3,9 +3,17 @@ Infinite mixture model : A generalization of Bayesian mixture models
 with an unspecified number of classes
 """
 import numpy as np
-from bgmm import BGMM, detsh
+from numpy.lib.stride_tricks import as_strided
+from bgmm import BGMM, detsh, generate_normals, generate_Wishart
 from scipy.special import gammaln
 
+# numba is optional; prange is missing from numba < 0.34, in which case
+# the numpy kernels are used as well
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 def co_labelling(z, kmax=None, kmin=None):
     """
@@ -44,6 +52,293 @@ def co_labelling(z, kmax=None, kmin=None):
     return colabel
 
 
+def _repeat_view(a, k):
+    """
+    return a view of a that repeats its first row k times, without copy
+
+    Parameters
+    ----------
+    a: array-like of shape (1, ...),
+       the row to be repeated
+    k: int,
+       the number of repetitions
+
+    Returns
+    -------
+    view: array of shape (k, ...) whose rows all share a[0]
+    """
+    a = np.asarray(a)
+    return as_strided(a, (k,) + a.shape[1:], (0,) + a.strides[1:])
+
+
+def _bincount(z, weights, size):
+    """
+    return np.bincount(z, weights), truncated or zero-padded to size
+
+    Parameters
+    ----------
+    z: array of shape(n), type = np.int,
+       non-negative values
+    weights: array of shape(n) or None,
+             the weights of the elements of z
+    size: int,
+          the number of bins
+
+    Returns
+    -------
+    counts: array of shape(size)
+    """
+    if weights is None:
+        counts = np.zeros(size, np.int)
+    else:
+        counts = np.zeros(size)
+    if z.size > 0:
+        bins = np.bincount(z, weights)[:size]
+        counts[:bins.size] = bins
+    return counts
+
+
+def _label_scatter(z, x, means):
+    """
+    return the scatter matrix of the rows of x of each label of z
+    around the corresponding row of means, in one pass over z and x
+
+    Parameters
+    ----------
+    z: array of shape(n_samples),
+       the labels, the values out of [0, k[ (e.g. the null class -1)
+       being ignored
+    x: array of shape(n_samples, dim),
+       the data
+    means: array of shape(k, dim),
+           the mean of each label
+
+    Returns
+    -------
+    scatter: array of shape(k, dim, dim)
+    """
+    k, dim = means.shape
+    # shift by one so that the null class falls into the first bin
+    z = np.asarray(z).astype(np.int) + 1
+    z[z > k] = 0
+    dx = x - np.vstack((np.zeros((1, dim)), means))[z]
+    outer = dx[:, :, np.newaxis] * dx[:, np.newaxis, :]
+    # one bin per (label, row, column) triple
+    bins = z[:, np.newaxis] * dim ** 2 + np.arange(dim ** 2)
+    scatter = _bincount(bins.ravel(), outer.ravel(), (k + 1) * dim ** 2)
+    return np.reshape(scatter[dim ** 2:], (k, dim, dim))
+
+
+def _gumbel_max(like):
+    """
+    Sample one class per row of like with the Gumbel-max trick
+
+    Parameters
+    ----------
+    like: array of shape (..., n_classes),
+          the (unnormalized) likelihood of each class
+
+    Returns
+    -------
+    z: array of shape like.shape[:-1], the draws,
+       that take values in [0..n_classes-1]
+
+    Notes
+    -----
+    argmax(log(like) + g), where g are independent standard Gumbel
+    variables, is distributed as like / like.sum(-1): given the
+    parameters, the memberships are independent, hence all of them are
+    drawn in one vectorized pass, without normalizing like
+    """
+    u = np.random.rand(*like.shape)
+    np_err = np.seterr(divide='ignore')
+    gumbel = - np.log(- np.log(u))
+    z = np.argmax(np.log(like) + gumbel, -1)
+    np.seterr(**np_err)
+    return z
+
+
+def _kfold_order(n_samples, kfold):
+    """
+    Randomly order the samples so that each cross-validation fold
+    is a contiguous block
+
+    Parameters
+    ----------
+    n_samples: int,
+               the number of samples
+    kfold: int, or array of shape(n_samples),
+           number of folds or fold index of each sample
+
+    Returns
+    -------
+    order: array of shape(n_samples),
+           a permutation of the samples
+    bounds: array of shape(n_folds + 1),
+            fold k is made of the samples order[bounds[k]:bounds[k + 1]]
+    """
+    if np.isscalar(kfold):
+        order = np.random.permutation(n_samples)
+        j = - (- n_samples // kfold)
+        bounds = np.minimum(n_samples, j * np.arange(kfold + 1))
+        return order, bounds
+
+    if np.array(kfold).size != n_samples:
+        raise ValueError('kfold and x do not have the same size')
+    # map the fold labels onto a random permutation of [0, n_folds[
+    uk = np.unique(kfold)
+    idx = np.random.permutation(uk.size)[np.searchsorted(uk, kfold)]
+    order = np.argsort(idx)
+    bounds = np.hstack((0, np.cumsum(np.bincount(idx))))
+    return order, bounds
+
+
+##################################################################
+# sampling kernels ###############################################
+##################################################################
+
+# The Gibbs sweep evaluates the likelihood under the prior, relabels
+# the membership variables, gathers the component statistics and
+# accumulates the likelihood at each step; when numba is available
+# these kernels are compiled to single passes over their input,
+# otherwise the numpy versions below are used.
+
+def _reduce_labels_numpy(z):
+    """Map the labels of z that are > -1 onto [0, k[ in place,
+    preserving their order, and return k"""
+    valid = z > - 1
+    uz = np.unique(z[valid])
+    z[valid] = np.searchsorted(uz, z[valid])
+    return uz.size
+
+
+def _relabel_new_numpy(z, k):
+    """Give a distinct new label (k, k+1, ...) to each element
+    of z that is equal to k, in place"""
+    new = z == k
+    z[new] = k + np.arange(np.sum(new))
+    return z
+
+
+def _add_row_sum_numpy(like, out):
+    """Add the row sums of the 2D array like to out, in place"""
+    out += like.sum(1)
+    return out
+
+
+def _label_stats_numpy(z, x, k):
+    """Return the number of elements of each label of z in [0, k[
+    and the sum of the corresponding rows of x"""
+    # shift by one so that the null class falls into the first bin
+    z = np.asarray(z).astype(np.int) + 1
+    counts = _bincount(z, None, k + 1)[1:]
+    sums = np.zeros((k, x.shape[1]))
+    for d in range(x.shape[1]):
+        sums[:, d] = _bincount(z, x[:, d], k + 1)[1:]
+    return counts, sums
+
+
+def _prior_like_numpy(x, m, b, tau, a, ldb, scalar_w):
+    """Return exp((scalar_w - (a + 1) * (log(1 + tau * q) - ldb)) / 2)
+    for each row of x, where q = (m - x).T * b * (m - x)"""
+    dx = m - x
+    if x.shape[1] == 1:
+        q = dx[:, 0] ** 2 * b[0, 0]
+    else:
+        q = np.sum(np.dot(dx, b) * dx, 1)
+    w = scalar_w - (a + 1) * (np.log1p(tau * q) - ldb)
+    w /= 2
+    return np.exp(w)
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _reduce_labels_numba(z):
+        """Map the labels of z that are > -1 onto [0, k[ in place,
+        preserving their order, and return k"""
+        n = z.shape[0]
+        lmax = -1
+        for i in range(n):
+            if z[i] > lmax:
+                lmax = int(z[i])
+        remap = np.zeros(lmax + 1, np.int64)
+        for i in range(n):
+            if z[i] > - 1:
+                remap[int(z[i])] = 1
+        k = 0
+        for label in range(lmax + 1):
+            if remap[label] > 0:
+                remap[label] = k
+                k += 1
+        for i in range(n):
+            if z[i] > - 1:
+                z[i] = remap[int(z[i])]
+        return k
+
+    @njit(cache=True)
+    def _relabel_new_numba(z, k):
+        """Give a distinct new label (k, k+1, ...) to each element
+        of z that is equal to k, in place"""
+        j = k
+        for i in range(z.shape[0]):
+            if z[i] == k:
+                z[i] = j
+                j += 1
+        return z
+
+    @njit(cache=True)
+    def _add_row_sum_numba(like, out):
+        """Add the row sums of the 2D array like to out, in place"""
+        for i in range(like.shape[0]):
+            acc = 0.
+            for j in range(like.shape[1]):
+                acc += like[i, j]
+            out[i] += acc
+        return out
+
+    @njit(cache=True)
+    def _label_stats_numba(z, x, k):
+        """Return the number of elements of each label of z in [0, k[
+        and the sum of the corresponding rows of x"""
+        counts = np.zeros(k, np.int64)
+        sums = np.zeros((k, x.shape[1]))
+        for i in range(z.shape[0]):
+            label = int(z[i])
+            if label > - 1 and label < k:
+                counts[label] += 1
+                for d in range(x.shape[1]):
+                    sums[label, d] += x[i, d]
+        return counts, sums
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _prior_like_numba(x, m, b, tau, a, ldb, scalar_w):
+        """Return exp((scalar_w - (a + 1) * (log(1 + tau * q) - ldb)) / 2)
+        for each row of x, where q = (m - x).T * b * (m - x)"""
+        n, dim = x.shape
+        like = np.empty(n)
+        for i in prange(n):
+            q = 0.
+            for j in range(dim):
+                for l in range(dim):
+                    q += (m[j] - x[i, j]) * b[j, l] * (m[l] - x[i, l])
+            w = scalar_w - (a + 1) * (np.log1p(tau * q) - ldb)
+            like[i] = np.exp(w / 2)
+        return like
+
+    _reduce_labels = _reduce_labels_numba
+    _relabel_new = _relabel_new_numba
+    _add_row_sum = _add_row_sum_numba
+    _label_stats = _label_stats_numba
+    _prior_like = _prior_like_numba
+else:
+    _reduce_labels = _reduce_labels_numpy
+    _relabel_new = _relabel_new_numpy
+    _add_row_sum = _add_row_sum_numpy
+    _label_stats = _label_stats_numpy
+    _prior_like = _prior_like_numpy
+
+
 class IMM(BGMM):
     """
     The class implements Infinite Gaussian Mixture model
@@ -69,7 +364,12 @@ class IMM(BGMM):
         self.prec_type = 'full'
 
         # initialize weights
-        self.weights = [1]
+        self.weights = np.ones(1)
+
+        # buffers for the parameters, grown as the number of components does
+        self._means_buf = np.zeros((0, dim))
+        self._precisions_buf = np.zeros((0, dim, dim))
+        self._like_buf = np.empty(0)
 
     def set_priors(self, x):
         """ Set the priors in order of having them weakly uninformative
@@ -101,7 +401,10 @@ class IMM(BGMM):
         self.prior_shrinkage = [self._prior_shrinkage]
 
         # cache some pre-computations
-        self._dets_ = detsh(px[0])
+        # px is diagonal: its log-determinant is the sum of the log of
+        # its diagonal, that neither overflows nor underflows
+        self._ldb = np.sum(np.log(np.diag(px[0])))
+        self._dets_ = np.exp(self._ldb)
         self._dets = [self._dets_]
         self._inv_prior_scale_ = np.reshape(np.linalg.inv(px[0]), elshape)
         self.prior_dens = None
@@ -155,25 +458,28 @@ class IMM(BGMM):
             z = np.zeros(x.shape[0])
             self.update(x, z)
 
-        like = self.likelihood(x, plike)
-        z = self.sample_indicator(like)
+        clike = self._likelihood_into(x, plike)
+        z = self.sample_indicator(clike)
 
         for i in range(niter):
             if  kfold == None:
-                like = self.simple_update(x, z, plike)
+                # the first step uses the draw above, the next ones
+                # compute the likelihood under the updated parameters
+                like = self.simple_update(x, z, plike, clike)
+                clike = None
             else:
                 like = self.cross_validated_update(x, z, plike, kfold)
 
             if sampling_points == None:
                 average_like += like
             else:
-                average_like += np.sum(
-                    self.likelihood(sampling_points, splike), 1)
+                _add_row_sum(self._likelihood_into(sampling_points, splike),
+                             average_like)
 
         average_like /= niter
         return average_like
 
-    def simple_update(self, x, z, plike):
+    def simple_update(self, x, z, plike, like=None):
         """
          This is a step in the sampling procedure
         that uses internal corss_validation
@@ -186,18 +492,23 @@ class IMM(BGMM):
            the associated membership variables
         plike: array of shape(n_samples),
                the likelihood under the prior
+        like: array of shape(n_samples, self.k + 1), optional,
+              the component-wise likelihood of the data under the
+              current parameters, from which z has been drawn;
+              by default it is computed and z is drawn again
 
         Returns
         -------
         like: array od shape(n_samples),
               the likelihood of the data
         """
-        like = self.likelihood(x, plike)
-        # standard + likelihood under the prior
-        # like has shape (x.shape[0], self.k+1)
+        if like is None:
+            like = self._likelihood_into(x, plike)
+            # standard + likelihood under the prior
+            # like has shape (x.shape[0], self.k+1)
 
-        z = self.sample_indicator(like)
-        # almost standard, but many new components can be created
+            z = self.sample_indicator(like)
+            # almost standard, but many new components can be created
 
         self.reduce(z)
         self.update(x, z)
@@ -225,44 +536,36 @@ class IMM(BGMM):
               the (cross-validated) likelihood of the data
         """
         n_samples = x.shape[0]
-        slike = np.zeros(n_samples)
-
-        if np.isscalar(kfold):
-            aux = np.argsort(np.random.rand(n_samples))
-            idx = - np.ones(n_samples).astype(np.int)
-            j = np.ceil(n_samples / kfold)
-            kmax = kfold
-            for k in range(kmax):
-                idx[aux[k * j:min(n_samples, j * (k + 1))]] = k
-        else:
-            if np.array(kfold).size != n_samples:
-                raise ValueError('kfold and x do not have the same size')
-            uk = np.unique(kfold)
-            np.random.shuffle(uk)
-            idx = np.zeros(n_samples).astype(np.int)
-            for i, k in enumerate(uk):
-                idx += (i * (kfold == k))
-            kmax = uk.max() + 1
-
-        for k in range(kmax):
-            test = np.zeros(n_samples).astype('bool')
-            test[idx == k] = 1
-            train = np.logical_not(test)
-
+        # every sample belongs to exactly one test fold
+        slike = np.empty(n_samples)
+        order, bounds = _kfold_order(n_samples, kfold)
+
+        # permute the data once: each test set is then a contiguous block
+        # of the permuted data, each training set a contiguous block of
+        # the permuted data repeated twice
+        xx = x[np.hstack((order, order))]
+        zp = z[order]
+        pp = plike[order]
+
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
             # remove a fraction of the data
             # and re-estimate the clusters
-            z[train] = self.reduce(z[train])
-            self.update(x[train], z[train])
+            z_train = np.hstack((zp[hi:], zp[:lo]))
+            self.reduce(z_train)
+            zp[hi:] = z_train[:n_samples - hi]
+            zp[:lo] = z_train[n_samples - hi:]
+            self.update(xx[hi:n_samples + lo], z_train)
 
             # draw the membership for the left-out datas
-            alike = self.likelihood(x[test], plike[test])
-            slike[test] = alike.sum(1)
+            alike = self._likelihood_into(xx[lo:hi], pp[lo:hi])
+            slike[order[lo:hi]] = alike.sum(1)
             # standard + likelihood under the prior
             # like has shape (x.shape[0], self.k+1)
 
-            z[test] = self.sample_indicator(alike)
+            zp[lo:hi] = self.sample_indicator(alike)
             # almost standard, but many new components can be created
 
+        z[order] = zp
         return slike
 
     def reduce(self, z):
@@ -277,10 +580,7 @@ class IMM(BGMM):
         -------
         z: the remapped values
         """
-        uz = np.unique(z[z > - 1])
-        for i, k in enumerate(uz):
-            z[z == k] = i
-        self.k = z.max() + 1
+        self.k = _reduce_labels(z)
         return z
 
     def update(self, x, z):
@@ -294,20 +594,176 @@ class IMM(BGMM):
           the corresponding classification
         """
         # re-dimension the priors in order to match self.k
-        self.prior_means = np.repeat(self._prior_means, self.k, 0)
+        # the priors are common to all components, hence not copied
+        self.prior_means = _repeat_view(self._prior_means, self.k)
         self.prior_dof = self._prior_dof * np.ones(self.k)
         self.prior_shrinkage = self._prior_shrinkage * np.ones(self.k)
         self._dets = self._dets_ * np.ones(self.k)
-        self._inv_prior_scale = np.repeat(self._inv_prior_scale_, self.k, 0)
+        self._inv_prior_scale = _repeat_view(self._inv_prior_scale_, self.k)
 
         # initialize some variables
-        self.means = np.zeros((self.k, self.dim))
-        self.precisions = np.zeros((self.k, self.dim, self.dim))
+        if self._means_buf.shape[0] < self.k:
+            cap = max(self.k, 2 * self._means_buf.shape[0])
+            self._means_buf = np.empty((cap, self.dim))
+            self._precisions_buf = np.empty((cap, self.dim, self.dim))
+        self.means = self._means_buf[:self.k]
+        self.precisions = self._precisions_buf[:self.k]
+
+        # proceed with the update, the statistics of the components
+        # being gathered in a single labelled pass over z and x
+        stats = _label_stats(z, x, self.k)
+        if self.dim == 1:
+            self._update_1d(x, z, stats)
+        else:
+            self.update_weights(z, stats[0])
+            self.update_precisions(x, z, stats)
+            self.update_means(x, z, stats)
 
-        # proceed with the update
-        BGMM.update(self, x, z)
+    def _update_1d(self, x, z, stats=None):
+        """ Update function specialized to self.dim == 1
 
-    def update_weights(self, z):
+        The Wishart and normal draws of BGMM.update reduce to
+        chi-square and scalar normal draws, so that all the components
+        are updated at once
+
+        Parameters
+        ----------
+        x array of shape (n_samples, 1)
+          the data used in the estimation process
+        z array of shape (n_samples), type = np.int
+          the corresponding classification
+        stats: tuple of arrays of shape (self.k) and (self.k, 1), optional,
+               the population and sum of the data of each component,
+               by default they are computed from z and x
+        """
+        if stats is None:
+            stats = _label_stats(z, x, self.k)
+        pop, sums = stats
+        self.update_weights(z, pop)
+
+        # per-component statistics
+        rpop = pop + (pop == 0)
+        empmeans = sums[:, 0] / rpop
+        scatter = _label_scatter(z, x, empmeans[:, np.newaxis])[:, 0, 0]
+
+        # precisions
+        self.dof = self.prior_dof + pop + 1
+        dm = empmeans - self.prior_means[:, 0]
+        covariance = self._inv_prior_scale[:, 0, 0] + scatter + \
+            dm ** 2 * self.prior_shrinkage
+        self.precisions[:, 0, 0] = np.random.chisquare(self.dof) / covariance
+        self._detp = self.precisions[:, 0, 0].copy()
+
+        # means
+        self.shrinkage = self.prior_shrinkage + pop
+        means = pop * empmeans + self.prior_means[:, 0] * \
+            self.prior_shrinkage
+        means /= self.shrinkage
+        self.means[:, 0] = means + np.random.randn(self.k) / np.sqrt(
+            self.precisions[:, 0, 0] * self.shrinkage)
+
+    def update_means(self, x, z, stats=None):
+        """
+        Given the allocation vector z,
+        and the corresponding data x,
+        resample the mean
+
+        Parameters
+        ----------
+        x: array of shape (n_samples,self.dim)
+          the data used in the estimation process
+        z: array of shape (n_samples), type = np.int
+          the corresponding classification
+        stats: tuple of arrays of shape (self.k) and (self.k, self.dim),
+               optional,
+               the population and sum of the data of each component,
+               by default they are computed from z and x
+
+        Notes
+        -----
+        Same as BGMM.update_means, but the population and sum of each
+        component are gathered in a single pass over z and x
+        """
+        if stats is None:
+            stats = _label_stats(z, x, self.k)
+        pop, sums = stats
+        self.shrinkage = self.prior_shrinkage + pop
+        shrinkage = np.reshape(self.shrinkage, (self.k, 1))
+        prior_shrinkage = np.reshape(self.prior_shrinkage, (self.k, 1))
+
+        means = sums + self.prior_means * prior_shrinkage
+        means /= shrinkage
+        for k in range(self.k):
+            self.means[k] = generate_normals(
+                means[k], self.precisions[k] * self.shrinkage[k])
+
+    def update_precisions(self, x, z, stats=None):
+        """
+        Given the allocation vector z,
+        and the corresponding data x,
+        resample the precisions
+
+        Parameters
+        ----------
+        x: array of shape (n_samples,self.dim)
+          the data used in the estimation process
+        z: array of shape (n_samples), type = np.int
+          the corresponding classification
+        stats: tuple of arrays of shape (self.k) and (self.k, self.dim),
+               optional,
+               the population and sum of the data of each component,
+               by default they are computed from z and x
+
+        Notes
+        -----
+        Same as BGMM.update_precisions, but the empirical means are
+        derived from the component sums and the scatter matrices are
+        gathered in a single pass over z and x
+        """
+        if stats is None:
+            stats = _label_stats(z, x, self.k)
+        pop, sums = stats
+        self.dof = self.prior_dof + pop + 1
+        rpop = pop + (pop == 0)
+        self._detp = np.zeros(self.k)
+
+        # empirical means and scatter
+        empmeans = sums / np.reshape(rpop, (self.k, 1))
+        scatter = _label_scatter(z, x, empmeans)
+
+        # bias
+        dm = empmeans - self.prior_means
+        addcov = dm[:, :, np.newaxis] * dm[:, np.newaxis, :]
+        addcov *= np.reshape(self.prior_shrinkage, (self.k, 1, 1))
+
+        # covariance = prior term + scatter + bias
+        covariance = self._inv_prior_scale + scatter + addcov
+
+        for k in range(self.k):
+            scale = np.linalg.inv(covariance[k])
+            self.precisions[k] = generate_Wishart(self.dof[k], scale)
+            self._detp[k] = detsh(self.precisions[k])
+
+    def pop(self, z):
+        """
+        compute the population, i.e. the statistics of allocation
+
+        Parameters
+        ----------
+        z array of shape (n_samples), type = np.int
+          the allocation variable,
+          the values out of [0, self.k[ (e.g. the null class -1)
+          are not counted
+
+        Returns
+        -------
+        hist : array shape (self.k) count variable
+        """
+        # shift by one so that the null class falls into the first bin
+        hist = _bincount(np.asarray(z).astype(np.int) + 1, None, self.k + 1)
+        return hist[1:]
+
+    def update_weights(self, z, pop=None):
         """
         Given the allocation vector z, resmaple the weights parameter
 
@@ -315,9 +771,16 @@ class IMM(BGMM):
         ----------
         z array of shape (n_samples), type = np.int
           the allocation variable
+        pop: array of shape (self.k), optional,
+             the population of each component,
+             by default it is computed from z
         """
-        pop = np.hstack((self.pop(z), 0))
-        self.weights = pop + self.prior_weights
+        if pop is None:
+            pop = self.pop(z)
+        self.weights = np.empty(self.k + 1)
+        self.weights[:self.k] = pop
+        self.weights[self.k] = 0
+        self.weights += self.prior_weights
         self.weights /= self.weights.sum()
 
     def sample_indicator(self, like):
@@ -335,11 +798,11 @@ class IMM(BGMM):
         Notes
         -----
         The behaviour is different from standard bgmm in that z can take
-        arbitrary values
+        arbitrary values.
+        All the memberships are drawn at once with the Gumbel-max trick
         """
-        z = BGMM.sample_indicator(self, like)
-        z[z == self.k] = self.k + np.arange(np.sum(z == self.k))
-        return z
+        z = _gumbel_max(like)
+        return _relabel_new(z, self.k)
 
     def likelihood_under_the_prior(self, x):
         """ Computes the likelihood of x under the prior
@@ -360,21 +823,40 @@ class IMM(BGMM):
         tau /= (1 + tau)
         m = self._prior_means
         b = self._prior_scale
-        ib = np.linalg.inv(b[0])
-        ldb = np.log(detsh(b[0]))
+        ldb = self._ldb
 
         scalar_w = np.log(tau / np.pi) * self.dim
         scalar_w += 2 * gammaln((a + 1) / 2)
         scalar_w -= 2 * gammaln((a - self.dim) / 2)
         scalar_w -= ldb * a
-        w = scalar_w * np.ones(x.shape[0])
 
-        for i in range(x.shape[0]):
-            w[i] -= (a + 1) * np.log(detsh(ib + tau * (m - x[i:i + 1]) *
-                                           (m - x[i:i + 1]).T))
+        # by the matrix determinant lemma, with ib = inv(b[0]),
+        # log(det(ib + tau * dx * dx.T)) = - ldb + log(1 + tau * dx.T * b * dx)
+        return _prior_like(x, m[0], b[0], tau, a, ldb, scalar_w)
+
+    def unweighted_likelihood(self, x):
+        """
+        return the likelihood of each data for each component
+        the values are not weighted by the component weights
+
+        Parameters
+        ----------
+        x: array of shape (n_samples,self.dim)
+           the data used in the estimation process
+
+        Returns
+        -------
+        like, array of shape(n_samples,self.k)
+          unweighted component-wise likelihood
+        """
+        if self.dim > 1:
+            return BGMM.unweighted_likelihood(self, x)
 
-        w /= 2
-        return np.exp(w)
+        # all the components at once with scalar formulas
+        precisions = self.precisions[:, 0, 0]
+        like = np.exp(- precisions * (x - self.means[:, 0]) ** 2 / 2)
+        like *= np.sqrt(precisions / (2 * np.pi))
+        return like
 
     def likelihood(self, x, plike=None):
         """
@@ -390,18 +872,37 @@ class IMM(BGMM):
 
         Returns
         -------
-        like, array of shape(nbitem,self.k)
+        like, array of shape(nbitem,self.k + 1)
         component-wise likelihood
         """
+        like = np.empty((x.shape[0], self.k + 1))
+        return self._write_likelihood(x, plike, like)
+
+    def _likelihood_into(self, x, plike=None):
+        """
+        Same as likelihood, but the result is a view on an internal
+        buffer, that is overwritten by the next call;
+        only meant for the sampling loops, that consume it at once
+        """
+        # grow the buffer geometrically if needed
+        n, k = x.shape[0], self.k
+        if self._like_buf.size < n * (k + 1):
+            self._like_buf = np.empty(max(n * (k + 1),
+                                          2 * self._like_buf.size))
+        like = self._like_buf[:n * (k + 1)].reshape(n, k + 1)
+        return self._write_likelihood(x, plike, like)
+
+    def _write_likelihood(self, x, plike, like):
+        """ Write the weighted likelihood of x in like,
+        an array of shape (n_samples, self.k + 1), and return it
+        """
         if plike == None:
             plike = self.likelihood_under_the_prior(x)
 
-        plike = np.reshape(plike, (x.shape[0], 1))
-        if self.k > 0:
-            like = self.unweighted_likelihood(x)
-            like = np.hstack((like, plike))
-        else:
-            like = plike
+        k = self.k
+        if k > 0:
+            like[:, :k] = self.unweighted_likelihood(x)
+        like[:, k] = plike
         like *= self.weights
         return like
 
@@ -494,8 +995,8 @@ class MixedIMM(IMM):
             z = np.zeros(x.shape[0])
             self.update(x, z)
 
-        like = self.likelihood(x, plike)
-        z = self.sample_indicator(like, null_class_proba)
+        llike = self._likelihood_into(x, plike)
+        z = self.sample_indicator(llike, null_class_proba)
 
         if co_clustering:
             from scipy.sparse import coo_matrix
@@ -503,24 +1004,28 @@ class MixedIMM(IMM):
 
         for i in range(niter):
             if  kfold == None:
-                like = self.simple_update(x, z, plike, null_class_proba)
+                # z has been drawn from llike, under the current parameters
+                like = self.simple_update(x, z, plike, null_class_proba,
+                                          llike)
             else:
                 like, z = self.cross_validated_update(x, z, plike,
                                                       null_class_proba, kfold)
 
-            llike = self.likelihood(x, plike)
+            if sampling_points == None:
+                average_like += like
+            else:
+                _add_row_sum(self._likelihood_into(sampling_points, splike),
+                             average_like)
+
+            # llike is reused by the next step: no likelihood call
+            # should overwrite it until then
+            llike = self._likelihood_into(x, plike)
             z = self.sample_indicator(llike, null_class_proba)
             pproba += (z == - 1)
 
             if co_clustering:
                 coclust = coclust + co_labelling(z, self.k, -1)
 
-            if sampling_points == None:
-                average_like += like
-            else:
-                average_like += np.sum(
-                    self.likelihood(sampling_points, splike), 1)
-
         average_like /= niter
         pproba /= niter
         if co_clustering:
@@ -528,7 +1033,7 @@ class MixedIMM(IMM):
             return average_like, pproba, coclust
         return average_like, pproba
 
-    def simple_update(self, x, z, plike, null_class_proba):
+    def simple_update(self, x, z, plike, null_class_proba, like=None):
         """ One step in the sampling procedure (one data sweep)
 
         Parameters
@@ -541,18 +1046,23 @@ class MixedIMM(IMM):
                the likelihood under the prior
         null_class_proba: array of shape(n_samples),
                           prior probability to be under the null
+        like: array of shape(n_samples, self.k + 1), optional,
+              the component-wise likelihood of the data under the
+              current parameters, from which z has been drawn;
+              by default it is computed and z is drawn again
 
         Returns
         -------
         like: array od shape(n_samples),
               the likelihood of the data under the H1 hypothesis
         """
-        like = self.likelihood(x, plike)
-        # standard + likelihood under the prior
-        # like has shape (x.shape[0], self.k+1)
+        if like is None:
+            like = self._likelihood_into(x, plike)
+            # standard + likelihood under the prior
+            # like has shape (x.shape[0], self.k+1)
 
-        z = self.sample_indicator(like, null_class_proba)
-        # almost standard, but many new components can be created
+            z = self.sample_indicator(like, null_class_proba)
+            # almost standard, but many new components can be created
 
         self.reduce(z)
         self.update(x, z)
@@ -590,45 +1100,35 @@ class MixedIMM(IMM):
         the order of updates
         """
         n_samples = x.shape[0]
-        slike = np.zeros(n_samples)
-
-        if np.isscalar(kfold):
-            aux = np.argsort(np.random.rand(n_samples))
-            idx = - np.ones(n_samples).astype(np.int)
-            j = np.ceil(n_samples / kfold)
-            kmax = kfold
-            for k in range(kmax):
-                idx[aux[k * j:min(n_samples, j * (k + 1))]] = k
-        else:
-            if np.array(kfold).size != n_samples:
-                raise ValueError('kfold and x do not have the same size')
-            uk = np.unique(kfold)
-            np.random.shuffle(uk)
-            idx = np.zeros(n_samples).astype(np.int)
-            for i, k in enumerate(uk):
-                idx += (i * (kfold == k))
-            kmax = uk.max() + 1
-
-        for k in range(kmax):
-            # split at iteration k
-            test = np.zeros(n_samples).astype('bool')
-            test[idx == k] = 1
-            train = np.logical_not(test)
+        # every sample belongs to exactly one test fold
+        slike = np.empty(n_samples)
+        order, bounds = _kfold_order(n_samples, kfold)
 
+        # permute the data once (see IMM.cross_validated_update)
+        xx = x[np.hstack((order, order))]
+        zp = z[order]
+        pp = plike[order]
+        ncp = null_class_proba[order]
+
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
             # remove a fraction of the data
             # and re-estimate the clusters
-            z[train] = self.reduce(z[train])
-            self.update(x[train], z[train])
+            z_train = np.hstack((zp[hi:], zp[:lo]))
+            self.reduce(z_train)
+            zp[hi:] = z_train[:n_samples - hi]
+            zp[:lo] = z_train[n_samples - hi:]
+            self.update(xx[hi:n_samples + lo], z_train)
 
             # draw the membership for the left-out data
-            alike = self.likelihood(x[test], plike[test])
-            slike[test] = alike.sum(1)
+            alike = self._likelihood_into(xx[lo:hi], pp[lo:hi])
+            slike[order[lo:hi]] = alike.sum(1)
             # standard + likelihood under the prior
             # like has shape (x.shape[0], self.k+1)
 
-            z[test] = self.sample_indicator(alike, null_class_proba[test])
+            zp[lo:hi] = self.sample_indicator(alike, ncp[lo:hi])
             # almost standard, but many new components can be created
 
+        z[order] = zp
         return slike, z
 
     def sample_indicator(self, like, null_class_proba):
@@ -655,9 +1155,8 @@ class MixedIMM(IMM):
         conditional_like_0 = np.reshape(null_class_proba *
                                         self.null_dens, (n, 1))
         conditional_like = np.hstack((conditional_like_0, conditional_like_1))
-        z = BGMM.sample_indicator(self, conditional_like) - 1
-        z[z == self.k] = self.k + np.arange(np.sum(z == self.k))
-        return z
+        z = _gumbel_max(conditional_like) - 1
+        return _relabel_new(z, self.k)
 
 
 def main():
@@ -5,12 +5,23 @@ Author : Bertrand Thirion, 2010
 """
 
 import numpy as np
+from scipy.special import gammaln
 
-from ..imm import IMM, MixedIMM, co_labelling
+from .. import imm
+from ..imm import (IMM, MixedIMM, co_labelling, _kfold_order,
+                   _label_scatter, _label_stats)
+from ..bgmm import BGMM
 
 from nose.tools import assert_true
 
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal, dec
+
+try:
+    import numba
+except ImportError:
+    have_numba = False
+else:
+    have_numba = True
 
 def test_colabel():
     # test the co_labelling functionality
@@ -24,6 +35,169 @@ def test_colabel():
     assert_array_equal(c, tc)
 
 
+def test_reduce():
+    # check that empty clusters are removed and the null class kept
+    igmm = IMM(.5, 1)
+    z = np.array([3, -1, 0, 3, 5, -1, 0])
+    z = igmm.reduce(z)
+    assert_array_equal(z, [1, -1, 0, 1, 2, -1, 0])
+    assert_true(igmm.k == 3)
+
+
+def test_label_stats():
+    # check the per-label counts and sums, the null class being ignored
+    z = np.array([1, -1, 0, 1, 2, -1, 0, 1])
+    x = np.random.randn(z.size, 2)
+    counts, sums = _label_stats(z, x, 3)
+    for k in range(3):
+        assert_true(counts[k] == np.sum(z == k))
+        assert_array_almost_equal(sums[k], x[z == k].sum(0))
+
+
+def test_label_scatter():
+    # check the per-label scatter matrices, the null class being ignored
+    z = np.array([1, -1, 0, 1, 2, -1, 0, 1])
+    x = np.random.randn(z.size, 2)
+    means = np.random.randn(3, 2)
+    scatter = _label_scatter(z, x, means)
+    for k in range(3):
+        dx = x[z == k] - means[k]
+        assert_array_almost_equal(scatter[k], np.dot(dx.T, dx))
+
+
+def test_kfold_order():
+    # check that the folds are contiguous blocks of the permutation
+    # whatever the values of the fold labels
+    for kfold in [np.array([2, 0, 1, 2, 2, 0, 1, 0, 2]),
+                  np.array([-1, 1, 0, -1, 1, 0, 0, -1, 1]),
+                  np.array([3, 7, 7, 3, 9, 3, 9, 7, 9])]:
+        order, bounds = _kfold_order(kfold.size, kfold)
+        assert_array_equal(np.sort(order), np.arange(kfold.size))
+        assert_true(bounds.size == 4)
+        assert_array_equal(bounds[[0, -1]], [0, kfold.size])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            assert_true(np.unique(kfold[order[lo:hi]]).size == 1)
+
+
+def test_unweighted_likelihood_1D():
+    # check the scalar 1D likelihood against the generic one
+    x = np.random.randn(20, 1)
+    igmm = IMM(.5, 1)
+    igmm.set_priors(x)
+    igmm.k = 3
+    igmm.update(x, np.arange(20) % 3)
+    assert_array_almost_equal(igmm.unweighted_likelihood(x),
+                              BGMM.unweighted_likelihood(igmm, x))
+
+
+def test_update_1D():
+    # check the posterior parameters of the 1D update against the generic
+    # ones, some samples being in the null class
+    x = np.random.randn(30, 1)
+    z = np.arange(30) % 4 - 1
+    igmm = IMM(.5, 1)
+    igmm.set_priors(x)
+    igmm.k = 3
+    igmm.update(x, z)
+    assert_array_equal(igmm._detp, igmm.precisions[:, 0, 0])
+    dof, shrinkage = igmm.dof.copy(), igmm.shrinkage.copy()
+    BGMM.update_precisions(igmm, x, z)
+    BGMM.update_means(igmm, x, z)
+    assert_array_almost_equal(igmm.dof, dof)
+    assert_array_almost_equal(igmm.shrinkage, shrinkage)
+
+
+def test_likelihood_not_shared():
+    # check that successive calls to likelihood return independent arrays
+    x = np.random.randn(20, 2)
+    igmm = IMM(.5, 2)
+    igmm.set_priors(x)
+    igmm.sample(x, niter=5, init=True)
+    l1 = igmm.likelihood(x)
+    l1_ = l1.copy()
+    l2 = igmm.likelihood(x[:10])
+    assert_array_equal(l1, l1_)
+    assert_array_equal(l2, l1[:10])
+
+
+def _explicit_prior_like(igmm, x):
+    # likelihood under the prior, with one determinant per sample
+    dim = igmm.dim
+    a = igmm._prior_dof
+    tau = igmm._prior_shrinkage
+    tau /= (1 + tau)
+    m = igmm._prior_means[0]
+    b = igmm._prior_scale[0]
+    ib = np.linalg.inv(b)
+    w = np.log(tau / np.pi) * dim
+    w += 2 * gammaln((a + 1) / 2)
+    w -= 2 * gammaln((a - dim) / 2)
+    w -= np.log(np.linalg.det(b)) * a
+    like = np.zeros(x.shape[0])
+    for i in range(x.shape[0]):
+        dx = m - x[i]
+        ld = np.log(np.linalg.det(ib + tau * np.outer(dx, dx)))
+        like[i] = np.exp((w - (a + 1) * ld) / 2)
+    return like
+
+
+def test_likelihood_under_the_prior():
+    # compare with the explicit determinants, in 1D and 3D
+    for dim in [1, 3]:
+        x = np.dot(np.random.randn(30, dim), np.random.randn(dim, dim))
+        igmm = IMM(.5, dim)
+        igmm.set_priors(x)
+        assert_array_almost_equal(igmm.likelihood_under_the_prior(x),
+                                  _explicit_prior_like(igmm, x))
+
+
+@dec.skipif(not have_numba)
+def test_numba_reduce_labels():
+    z = np.random.randint(-1, 8, 50)
+    z1, z2 = z.copy(), z.copy()
+    assert_true(imm._reduce_labels_numba(z1) ==
+                imm._reduce_labels_numpy(z2))
+    assert_array_equal(z1, z2)
+
+
+@dec.skipif(not have_numba)
+def test_numba_relabel_new():
+    z = np.random.randint(-1, 4, 50)
+    assert_array_equal(imm._relabel_new_numba(z.copy(), 3),
+                       imm._relabel_new_numpy(z.copy(), 3))
+
+
+@dec.skipif(not have_numba)
+def test_numba_add_row_sum():
+    like = np.random.rand(20, 4)
+    out = np.random.rand(20)
+    assert_array_almost_equal(imm._add_row_sum_numba(like, out.copy()),
+                              imm._add_row_sum_numpy(like, out.copy()))
+
+
+@dec.skipif(not have_numba)
+def test_numba_label_stats():
+    z = np.random.randint(-1, 5, 50)
+    x = np.random.randn(50, 3)
+    counts1, sums1 = imm._label_stats_numba(z, x, 5)
+    counts2, sums2 = imm._label_stats_numpy(z, x, 5)
+    assert_array_equal(counts1, counts2)
+    assert_array_almost_equal(sums1, sums2)
+
+
+@dec.skipif(not have_numba)
+def test_numba_prior_like():
+    for dim in [1, 3]:
+        x = np.random.randn(30, dim)
+        m = np.random.randn(dim)
+        a = np.random.randn(dim, dim)
+        b = np.dot(a, a.T) + np.eye(dim)
+        ldb = np.log(np.linalg.det(b))
+        args = (x, m, b, .5, dim + 2., ldb, -1.)
+        assert_array_almost_equal(imm._prior_like_numba(*args),
+                                  imm._prior_like_numpy(*args))
+
+
 def test_imm_loglike_1D():
     # Check that the log-likelihood of the data under the infinite gaussian
     # mixture model is close to the theoretical data likelihood
@@ -104,6 +104,7 @@ You will probably also like to have:
 * ipython_ for interactive work
 * matplotlib_ for 2D plotting
 * mayavi_ for 3D plotting
+* numba_ to speed up the sampling in ``nipy.algorithms.clustering.imm``
 
 .. _python: http://python.org
 .. _numpy: http://numpy.scipy.org
@@ -113,6 +114,7 @@ You will probably also like to have:
 .. _ipython: http://ipython.scipy.org
 .. _matplotlib: http://matplotlib.sourceforge.net
 .. _mayavi: http://code.enthought.com/projects/mayavi/
+.. _numba: http://numba.pydata.org
 
 License
 =======